@@ -2,11 +2,12 @@ package storage
 
 import (
 	"context"
-	"errors"
+	"sync"
 	"time"
 
 	"gorm.io/driver/postgres"
 	"gorm.io/gorm"
+	"gorm.io/gorm/clause"
 	"gorm.io/gorm/logger"
 )
 
@@ -16,7 +17,7 @@ type User struct {
 	MaxID          int64            `gorm:"uniqueIndex"`
 	IsSubscribed   bool             `gorm:"not null"`
 	QuestionAnswer []QuestionAnswer `gorm:"foreignKey:UserID"`
-	CreatedAt      time.Time
+	CreatedAt      time.Time        `gorm:"autoCreateTime:false;default:now()"`
 	UpdatedAt      time.Time
 }
 
@@ -32,9 +33,9 @@ type QuestionAnswer struct {
 	Answer        string `gorm:"type:text"`
 	ConfluenceURL string `gorm:"type:text"`
 	Score         *int
-	UserID        int64 `gorm:"index"`
-	StopPoint     bool  `gorm:"not null;default:false"`
-	CreatedAt     time.Time
+	UserID        int64     `gorm:"index:ix_question_answer_user_id_created_at,priority:1"`
+	StopPoint     bool      `gorm:"not null;default:false"`
+	CreatedAt     time.Time `gorm:"autoCreateTime:false;default:now();index:ix_question_answer_user_id_created_at,priority:2,sort:desc"`
 	UpdatedAt     time.Time
 }
 
@@ -46,6 +47,31 @@ func (QuestionAnswer) TableName() string {
 // Store wraps a GORM connection and exposes helper methods.
 type Store struct {
 	db *gorm.DB
+
+	mu      sync.RWMutex
+	userIDs map[int64]int64 // max_id -> user.id; the mapping never changes
+
+	histMu  sync.Mutex
+	history map[historyKey]historyEntry
+}
+
+// historyCacheTTL bounds how stale a cached history may get; retry loops
+// within one message land inside it, ordinary conversation does not.
+const historyCacheTTL = 2 * time.Second
+
+// historyCacheMaxSize caps the cache so readers who never write again
+// cannot grow the map without bound.
+const historyCacheMaxSize = 10000
+
+type historyKey struct {
+	userID     int64
+	minutes    int
+	limitPairs int
+}
+
+type historyEntry struct {
+	records []QuestionAnswer
+	expires time.Time
 }
 
 // New initialises the database connection and runs migrations.
@@ -58,54 +84,91 @@ func New(dsn string) (*Store, error) {
 	if err := db.AutoMigrate(&User{}, &QuestionAnswer{}); err != nil {
 		return nil, err
 	}
-	return &Store{db: db}, nil
+	sqlDB, err := db.DB()
+	if err != nil {
+		return nil, err
+	}
+	sqlDB.SetMaxOpenConns(30)
+	sqlDB.SetMaxIdleConns(10)
+	sqlDB.SetConnMaxLifetime(30 * time.Minute)
+	return &Store{
+		db:      db,
+		userIDs: make(map[int64]int64),
+		history: make(map[historyKey]historyEntry),
+	}, nil
 }
 
 // EnsureUser creates a record for the given MAX id if it doesn't exist.
+// INSERT ... ON CONFLICT (max_id) DO NOTHING replaces the previous
+// SELECT-then-INSERT, which raced under concurrent messages from a new
+// user; the id lookup only runs when the row already existed. Resolved
+// ids are cached in-process, so repeat messages skip the database hop.
 func (s *Store) EnsureUser(ctx context.Context, maxID int64) (bool, int64, error) {
-	var user User
-	tx := s.db.WithContext(ctx).Where("max_id = ?", maxID).First(&user)
-	if errors.Is(tx.Error, gorm.ErrRecordNotFound) {
-		user = User{MaxID: maxID, IsSubscribed: true}
-		if err := s.db.WithContext(ctx).Create(&user).Error; err != nil {
-			return false, 0, err
-		}
-		return true, user.ID, nil
+	s.mu.RLock()
+	id, ok := s.userIDs[maxID]
+	s.mu.RUnlock()
+	if ok {
+		return false, id, nil
 	}
+	user := User{MaxID: maxID, IsSubscribed: true}
+	tx := s.db.WithContext(ctx).
+		Clauses(clause.OnConflict{Columns: []clause.Column{{Name: "max_id"}}, DoNothing: true}).
+		Create(&user)
 	if tx.Error != nil {
 		return false, 0, tx.Error
 	}
-	return false, user.ID, nil
+	if tx.RowsAffected > 0 {
+		s.cacheUserID(maxID, user.ID)
+		return true, user.ID, nil
+	}
+	var existing User
+	if err := s.db.WithContext(ctx).Select("id").Where("max_id = ?", maxID).Take(&existing).Error; err != nil {
+		return false, 0, err
+	}
+	s.cacheUserID(maxID, existing.ID)
+	return false, existing.ID, nil
+}
+
+func (s *Store) cacheUserID(maxID, id int64) {
+	s.mu.Lock()
+	s.userIDs[maxID] = id
+	s.mu.Unlock()
 }
 
 // ToggleSubscription switches subscription flag and returns the new state.
+// The flag is flipped atomically in a single UPDATE ... RETURNING instead
+// of load, mutate in Go and Save, which took two round-trips and could
+// lose a concurrent toggle.
 func (s *Store) ToggleSubscription(ctx context.Context, userID int64) (bool, error) {
-	var user User
-	if err := s.db.WithContext(ctx).First(&user, userID).Error; err != nil {
-		return false, err
+	var isSubscribed bool
+	tx := s.db.WithContext(ctx).
+		Raw(
+			`UPDATE "user" SET is_subscribed = NOT is_subscribed, updated_at = now() WHERE id = ? RETURNING is_subscribed`,
+			userID,
+		).
+		Scan(&isSubscribed)
+	if tx.Error != nil {
+		return false, tx.Error
 	}
-	user.IsSubscribed = !user.IsSubscribed
-	if err := s.db.WithContext(ctx).Save(&user).Error; err != nil {
-		return false, err
+	if tx.RowsAffected == 0 {
+		return false, gorm.ErrRecordNotFound
 	}
-	return user.IsSubscribed, nil
+	return isSubscribed, nil
 }
 
-// CheckSpam replicates the legacy "more than 5 questions within a minute" heuristic.
+// CheckSpam replicates the legacy "more than 5 questions within a minute"
+// heuristic as a single indexed aggregate. Comparing created_at against the
+// database's own now() keeps the check correct regardless of bot-host clock
+// skew or timezone configuration.
 func (s *Store) CheckSpam(ctx context.Context, userID int64) (bool, error) {
-	var qas []QuestionAnswer
+	var count int64
 	if err := s.db.WithContext(ctx).
-		Where("user_id = ?", userID).
-		Order("created_at desc").
-		Limit(5).
-		Find(&qas).Error; err != nil {
+		Model(&QuestionAnswer{}).
+		Where("user_id = ? AND created_at > now() - interval '1 minute'", userID).
+		Count(&count).Error; err != nil {
 		return false, err
 	}
-	if len(qas) < 5 {
-		return false, nil
-	}
-	fifth := qas[len(qas)-1]
-	return time.Since(fifth.CreatedAt) < time.Minute, nil
+	return count >= 5, nil
 }
 
 // AddQuestionAnswer inserts a new record and returns its id.
@@ -123,6 +186,7 @@ func (s *Store) AddQuestionAnswer(ctx context.Context, userID int64, question, a
 	if err := s.db.WithContext(ctx).Create(&qa).Error; err != nil {
 		return 0, err
 	}
+	s.invalidateHistory(userID)
 	return qa.ID, nil
 }
 
@@ -133,38 +197,80 @@ func (s *Store) RateAnswer(ctx context.Context, qaID int64, score int) (bool, er
 	return tx.RowsAffected > 0, tx.Error
 }
 
-// GetHistory returns recent question/answers for dialog context.
+// GetHistory returns recent question/answers for dialog context. Results
+// are cached per (user, window, limit) for historyCacheTTL so repeated
+// reads inside one processing burst hit memory instead of Postgres;
+// AddQuestionAnswer and SetStopPoint invalidate the user's entries.
 func (s *Store) GetHistory(ctx context.Context, userID int64, minutes int, limitPairs int) ([]QuestionAnswer, error) {
 	if minutes <= 0 {
 		minutes = 30
 	}
-	cutoff := time.Now().Add(-time.Duration(minutes) * time.Minute)
-	var records []QuestionAnswer
+	if limitPairs <= 0 {
+		limitPairs = 5
+	}
+	key := historyKey{userID: userID, minutes: minutes, limitPairs: limitPairs}
+	s.histMu.Lock()
+	entry, ok := s.history[key]
+	if ok && time.Now().Before(entry.expires) {
+		records := make([]QuestionAnswer, len(entry.records))
+		copy(records, entry.records)
+		s.histMu.Unlock()
+		return records, nil
+	}
+	s.histMu.Unlock()
+	// The recency window is evaluated against the database clock so it
+	// agrees with the server-side created_at defaults.
+	var answered []QuestionAnswer
 	if err := s.db.WithContext(ctx).
-		Where("user_id = ? AND created_at >= ?", userID, cutoff).
-		Order("created_at asc").
-		Find(&records).Error; err != nil {
+		Where("user_id = ? AND created_at >= now() - make_interval(mins => ?) AND answer <> ''", userID, minutes).
+		Order("created_at desc").
+		Limit(limitPairs).
+		Find(&answered).Error; err != nil {
 		return nil, err
 	}
-	if limitPairs <= 0 {
-		limitPairs = 5
+	// The limited query returns newest-first; restore chronological order.
+	for i, j := 0, len(answered)-1; i < j; i, j = i+1, j-1 {
+		answered[i], answered[j] = answered[j], answered[i]
 	}
-	answered := make([]QuestionAnswer, 0)
-	for _, qa := range records {
-		if qa.Answer != "" {
-			answered = append(answered, qa)
+	var unanswered []QuestionAnswer
+	if err := s.db.WithContext(ctx).
+		Where("user_id = ? AND created_at >= now() - make_interval(mins => ?) AND answer = ''", userID, minutes).
+		Order("created_at asc").
+		Find(&unanswered).Error; err != nil {
+		return nil, err
+	}
+	records := append(answered, unanswered...)
+	// Cache a private copy so callers mutating the returned slice cannot
+	// corrupt the entry; hits copy in the other direction.
+	cached := make([]QuestionAnswer, len(records))
+	copy(cached, records)
+	s.histMu.Lock()
+	now := time.Now()
+	for staleKey, entry := range s.history {
+		if now.After(entry.expires) {
+			delete(s.history, staleKey)
 		}
 	}
-	if len(answered) > limitPairs {
-		answered = answered[len(answered)-limitPairs:]
+	if len(s.history) >= historyCacheMaxSize {
+		// Unreachable in practice with a 2 s TTL; reset rather than grow.
+		s.history = make(map[historyKey]historyEntry)
 	}
-	unanswered := make([]QuestionAnswer, 0)
-	for _, qa := range records {
-		if qa.Answer == "" {
-			unanswered = append(unanswered, qa)
+	s.history[key] = historyEntry{
+		records: cached,
+		expires: now.Add(historyCacheTTL),
+	}
+	s.histMu.Unlock()
+	return records, nil
+}
+
+func (s *Store) invalidateHistory(userID int64) {
+	s.histMu.Lock()
+	for key := range s.history {
+		if key.userID == userID {
+			delete(s.history, key)
 		}
 	}
-	return append(answered, unanswered...), nil
+	s.histMu.Unlock()
 }
 
 // FilterHistory trims history using stop points and ordering rules.
@@ -172,10 +278,13 @@ func FilterHistory(history []QuestionAnswer) (answered []QuestionAnswer, unanswe
 	if len(history) == 0 {
 		return nil, nil
 	}
+	// History is chronological, so scanning backwards finds the last stop
+	// point without walking entries that precede it.
 	lastStop := -1
-	for i, qa := range history {
-		if qa.StopPoint {
+	for i := len(history) - 1; i >= 0; i-- {
+		if history[i].StopPoint {
 			lastStop = i
+			break
 		}
 	}
 	trimmed := history
@@ -192,8 +301,10 @@ func FilterHistory(history []QuestionAnswer) (answered []QuestionAnswer, unanswe
 	if len(answered) == 0 {
 		return nil, unanswered
 	}
+	// History is chronological, so the last answered entry carries the
+	// newest answer timestamp; no extra scan is needed to find it.
 	lastAnswerTime := answered[len(answered)-1].CreatedAt
-	filteredUnanswered := make([]QuestionAnswer, 0, len(unanswered))
+	filteredUnanswered := unanswered[:0]
 	for _, qa := range unanswered {
 		if qa.CreatedAt.After(lastAnswerTime) {
 			filteredUnanswered = append(filteredUnanswered, qa)
@@ -202,19 +313,21 @@ func FilterHistory(history []QuestionAnswer) (answered []QuestionAnswer, unanswe
 	return answered, filteredUnanswered
 }
 
-// SetStopPoint marks the latest QA entry as stop_point.
+// SetStopPoint marks the latest QA entry as stop_point. A single UPDATE
+// with a scalar subquery replaces the previous SELECT-then-Save, which
+// loaded and wrote back the whole row just to flip one flag.
 func (s *Store) SetStopPoint(ctx context.Context, userID int64, val bool) error {
-	var qa QuestionAnswer
-	tx := s.db.WithContext(ctx).
+	latest := s.db.Model(&QuestionAnswer{}).
+		Select("id").
 		Where("user_id = ?", userID).
 		Order("created_at desc").
-		First(&qa)
-	if errors.Is(tx.Error, gorm.ErrRecordNotFound) {
-		return nil
-	}
-	if tx.Error != nil {
-		return tx.Error
+		Limit(1)
+	err := s.db.WithContext(ctx).
+		Model(&QuestionAnswer{}).
+		Where("id = (?)", latest).
+		Update("stop_point", val).Error
+	if err == nil {
+		s.invalidateHistory(userID)
 	}
-	qa.StopPoint = val
-	return s.db.WithContext(ctx).Save(&qa).Error
+	return err
 }
@@ -0,0 +1,33 @@
+"""Add user_id + created_at index to question_answer
+
+Revision ID: b7d41f0c9e2a
+Revises: 325fceb64c8c
+Create Date: 2026-08-28 10:12:41.553208
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "b7d41f0c9e2a"
+down_revision: Union[str, None] = "325fceb64c8c"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index(
+        "ix_question_answer_user_id_created_at",
+        "question_answer",
+        ["user_id", sa.text("created_at DESC")],
+    )
+
+
+def downgrade() -> None:
+    op.drop_index(
+        "ix_question_answer_user_id_created_at", table_name="question_answer"
+    )
@@ -0,0 +1,32 @@
+"""Add ivfflat index on question_answer embedding
+
+Revision ID: c3f8a9d12b45
+Revises: b7d41f0c9e2a
+Create Date: 2026-08-28 11:03:17.894621
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "c3f8a9d12b45"
+down_revision: Union[str, None] = "b7d41f0c9e2a"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute(
+        """
+        CREATE INDEX ix_question_answer_embedding ON question_answer
+        USING ivfflat (embedding vector_cosine_ops) WITH (lists = 100);
+        """
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_question_answer_embedding", table_name="question_answer")
@@ -5,7 +5,7 @@ from langchain_community.document_loaders import PyPDFLoader
 from langchain_core.documents import Document
 from langchain_text_splitters import TextSplitter
 from sentence_transformers import SentenceTransformer
-from sqlalchemy import Engine, select
+from sqlalchemy import Engine, insert, select
 from sqlalchemy.orm import Session
 from config import Config
 from database import Chunk
@@ -95,16 +95,18 @@ def reindex_confluence(
             Document(page_content=page_content, metadata={"page_link": page_link})
         )
     all_splits = text_splitter.split_documents(documents)
+    rows = [
+        {
+            "confluence_url": chunk.metadata["page_link"],
+            "text": chunk.page_content,
+            "embedding": encoder_model.encode(chunk.page_content),
+        }
+        for chunk in all_splits
+    ]
     with Session(engine) as session:
         session.query(Chunk).delete()
-        for chunk in all_splits:
-            session.add(
-                Chunk(
-                    confluence_url=chunk.metadata["page_link"],
-                    text=chunk.page_content,
-                    embedding=encoder_model.encode(chunk.page_content),
-                )
-            )
+        if rows:
+            session.execute(insert(Chunk), rows)
         session.commit()
     logging.warning("INDEX CREATED")
 
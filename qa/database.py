@@ -1,28 +1,62 @@
-import numpy as np
+import csv
+import io
 from pgvector.sqlalchemy import Vector
-from typing import Optional, List, TypedDict
+from typing import Iterable, Iterator, Optional, List, TypedDict
 from sentence_transformers import SentenceTransformer
 from sqlalchemy import (
     Text,
     Column,
     DateTime,
+    create_engine,
     func,
     ForeignKey,
     BigInteger,
     Engine,
+    Index,
+    insert,
+    lambda_stmt,
     select,
+    text,
     update,
 )
 from sqlalchemy.orm import (
+    DeclarativeBase,
     Mapped,
     Session,
-    declarative_base,
     mapped_column,
     relationship,
 )
 from sqlalchemy.exc import SQLAlchemyError
+from config import Config
 
-Base = declarative_base()
+
+class Base(DeclarativeBase):
+    """Базовый класс моделей"""
+
+
+_engine: Optional[Engine] = None
+
+
+def get_engine() -> Engine:
+    """Возвращает общий на процесс Engine с настроенным пулом соединений
+
+    Engine создаётся один раз: сессии переиспользуют готовые соединения
+    из QueuePool вместо нового подключения к Postgres на каждый запрос.
+
+    Returns:
+        Engine: подключение к БД с пулом соединений
+    """
+    global _engine
+    if _engine is None:
+        _engine = create_engine(
+            Config.SQLALCHEMY_DATABASE_URI,
+            pool_size=10,
+            max_overflow=20,
+            pool_pre_ping=True,
+            pool_recycle=1800,
+            insertmanyvalues_page_size=1000,
+        )
+    return _engine
 
 
 class User(Base):
@@ -49,6 +83,7 @@ class User(Base):
         back_populates="user",
         cascade="all, delete-orphan",
         order_by="desc(QuestionAnswer.created_at)",
+        lazy="raise_on_sql",
     )
 
     created_at = Column(DateTime(timezone=True), server_default=func.now())
@@ -71,7 +106,7 @@ class Chunk(Base):
     id: Mapped[int] = mapped_column(primary_key=True)
     confluence_url: Mapped[str] = mapped_column(Text(), index=True)
     text: Mapped[str] = mapped_column(Text())
-    embedding: Mapped[Vector] = mapped_column(Vector(1024))
+    embedding: Mapped[Vector] = mapped_column(Vector(1024), deferred=True)
 
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
@@ -94,16 +129,25 @@ class QuestionAnswer(Base):
     """
 
     __tablename__ = "question_answer"
+    __table_args__ = (
+        Index(
+            "ix_question_answer_user_id_created_at",
+            "user_id",
+            text("created_at DESC"),
+        ),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     question: Mapped[str] = mapped_column(Text())
-    embedding: Mapped[Vector] = mapped_column(Vector(1024))
+    embedding: Mapped[Vector] = mapped_column(Vector(1024), deferred=True)
     answer: Mapped[Optional[str]] = mapped_column(Text())
     confluence_url: Mapped[Optional[str]] = mapped_column(Text(), index=True)
     score: Mapped[Optional[int]] = mapped_column()
     user_id: Mapped[int] = mapped_column(ForeignKey("user.id"))
 
-    user: Mapped["User"] = relationship(back_populates="question_answers")
+    user: Mapped["User"] = relationship(
+        back_populates="question_answers", lazy="raise_on_sql"
+    )
 
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
@@ -119,16 +163,13 @@ def get_answer_by_id(engine: Engine, question_answer_id: int) -> str:
     Returns:
         str: текст ответа на вопрос
     """
-    with Session(engine) as session:
-        answer = str(
-            session.execute(
-                select(QuestionAnswer.answer, QuestionAnswer.question).where(
-                    QuestionAnswer.id == question_answer_id
-                )
-            )
-            .scalars()
-            .first()
+    stmt = lambda_stmt(
+        lambda: select(QuestionAnswer.answer, QuestionAnswer.question).where(
+            QuestionAnswer.id == question_answer_id
         )
+    )
+    with Session(engine) as session:
+        answer = str(session.execute(stmt).scalars().first())
     return answer
 
 
@@ -146,11 +187,7 @@ def set_embedding(engine: Engine, question_answer_id: int, embed):
     with Session(engine) as session:
         try:
             with session.begin():
-                question_answer = (
-                    session.query(QuestionAnswer)
-                    .filter_by(id=question_answer_id)
-                    .first()
-                )
+                question_answer = session.get(QuestionAnswer, question_answer_id)
                 if question_answer:
                     question_answer.embedding = embed
                 else:
@@ -160,13 +197,153 @@ def set_embedding(engine: Engine, question_answer_id: int, embed):
             raise e
 
 
+def add_question_answers(engine: Engine, rows: List[dict]) -> List[int]:
+    """Добавляет пачку QuestionAnswer одним запросом
+
+    Вместо вставки по одной строке использует insertmanyvalues SQLAlchemy 2.0:
+    параметры группируются в многострочный INSERT ... RETURNING id.
+
+    Args:
+        engine (Engine): текущее подключение к БД
+        rows (List[dict]): список словарей с полями QuestionAnswer
+
+    Returns:
+        List[int]: id добавленных QuestionAnswer в порядке переданных строк
+    """
+    if not rows:
+        return []
+
+    with Session(engine) as session:
+        ids = (
+            session.execute(
+                insert(QuestionAnswer).returning(
+                    QuestionAnswer.id, sort_by_parameter_order=True
+                ),
+                rows,
+            )
+            .scalars()
+            .all()
+        )
+        session.commit()
+    return list(ids)
+
+
+_COPY_NULL = r"\N"
+
+
+def _question_answer_csv_line(row: dict) -> str:
+    """Кодирует один QuestionAnswer в строку CSV для COPY
+
+    None передаётся сигнальным значением `\\N` вместо пустого поля:
+    в формате CSV COPY читает пустое поле как NULL, и пустой ответ
+    (`answer=\"\"`) превратился бы в `answer IS NULL`.
+    """
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow(
+        [
+            _COPY_NULL if value is None else value
+            for value in (
+                row["question"],
+                row.get("answer"),
+                row.get("confluence_url"),
+                row.get("score"),
+                row["user_id"],
+            )
+        ]
+    )
+    return buffer.getvalue()
+
+
+class _CopyStream(io.TextIOBase):
+    """Файловый интерфейс над итератором строк CSV для copy_expert
+
+    Строки вытягиваются из итератора по мере чтения, поэтому весь
+    набор данных в память не загружается.
+    """
+
+    def __init__(self, lines: Iterator[str]):
+        self._lines = lines
+        self._tail = ""
+        self.rows = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def read(self, size: int = -1) -> str:
+        chunks = [self._tail]
+        length = len(self._tail)
+        while size < 0 or length < size:
+            line = next(self._lines, None)
+            if line is None:
+                break
+            self.rows += 1
+            chunks.append(line)
+            length += len(line)
+        data = "".join(chunks)
+        if 0 <= size < len(data):
+            self._tail = data[size:]
+            data = data[:size]
+        else:
+            self._tail = ""
+        return data
+
+
+def bulk_import_question_answers(engine: Engine, rows: Iterable[dict]) -> int:
+    """Импортирует исторические QuestionAnswer через Postgres COPY
+
+    COPY работает на уровне протокола без разбора и планирования каждой
+    строки, поэтому для больших выгрузок он заметно быстрее даже
+    пакетного INSERT. ORM при этом не используется вовсе, а строки
+    кодируются в CSV потоково — пиковая память не зависит от размера
+    импорта.
+
+    Args:
+        engine (Engine): текущее подключение к БД
+        rows (Iterable[dict]): словари с полями `question`, `answer`,
+            `confluence_url`, `score` и `user_id`
+
+    Returns:
+        int: количество импортированных строк
+    """
+    stream = _CopyStream(_question_answer_csv_line(row) for row in rows)
+    raw = engine.raw_connection()
+    try:
+        with raw.cursor() as cursor:
+            cursor.copy_expert(
+                "COPY question_answer (question, answer, confluence_url, score, user_id) "
+                "FROM STDIN WITH (FORMAT csv, NULL '\\N')",
+                stream,
+            )
+        raw.commit()
+    finally:
+        raw.close()
+    return stream.rows
+
+
+def set_embeddings(engine: Engine, rows: List[dict]) -> None:
+    """Задает векторные представления пачке вопросов одной транзакцией
+
+    Вместо отдельной сессии с SELECT и UPDATE на каждый вопрос выполняет
+    один executemany-UPDATE по первичному ключу и один commit.
+
+    Args:
+        engine (Engine): текущее подключение к БД
+        rows (List[dict]): словари с ключами `id` и `embedding`
+    """
+    if not rows:
+        return
+
+    with Session(engine) as session:
+        session.execute(update(QuestionAnswer), rows)
+        session.commit()
+
+
 class QuestionDict(TypedDict):
-    """Класс вопроса с векторным представлением"""
+    """Класс вопроса с ответом и ссылкой на источник"""
 
     id: int
     question: str
     answer: str
-    embedding: np.ndarray
     url: str
 
 
@@ -175,65 +352,75 @@ def get_all_questions_with_score(
 ) -> List[QuestionDict]:
     """Получает все вопросы с оценкой "отлично", либо все вопросы с оценками, если `highscore` == `False`
 
+    Векторные представления не выбираются, поэтому строки компактны и
+    материализуются целиком: сессия и транзакция закрываются до того,
+    как вызывающий код начнёт свою медленную пообъектную обработку.
+
     Args:
         engine (Engine): текущее подключение к БД
 
     Returns:
-        List[QuestionDict]: Список QuestionDict с id вопроса, его ответом, векторным представлением и ссылкой на Confluence
+        List[QuestionDict]: Список QuestionDict с id вопроса, его ответом и ссылкой на Confluence
     """
 
+    stmt = select(
+        QuestionAnswer.id,
+        QuestionAnswer.question,
+        QuestionAnswer.answer,
+        QuestionAnswer.confluence_url,
+    )
     if highscore:
-        with Session(engine) as session:
-            question_answers = session.execute(
-                select(
-                    QuestionAnswer.id,
-                    QuestionAnswer.question,
-                    QuestionAnswer.answer,
-                    QuestionAnswer.embedding,
-                    QuestionAnswer.confluence_url,
-                ).where(QuestionAnswer.score == 5)
-            ).all()
-
-        result: List[QuestionDict] = [
-            {
-                "id": int(qa_id),
-                "question": str(question_text),
-                "answer": str(answer_text),
-                "embedding": (
-                    np.array(embedding) if embedding is not None else np.array([])
-                ),
-                "url": str(url),
-            }
-            for qa_id, question_text, answer_text, embedding, url in question_answers
-        ]
-
-        return result
+        stmt = stmt.where(QuestionAnswer.score == 5)
     else:
-        with Session(engine) as session:
-            question_answers = session.execute(
-                select(
-                    QuestionAnswer.id,
-                    QuestionAnswer.question,
-                    QuestionAnswer.answer,
-                    QuestionAnswer.embedding,
-                    QuestionAnswer.confluence_url,
-                ).where(QuestionAnswer.score != None)
-            ).all()
-
-        result: List[QuestionDict] = [
-            {
-                "id": int(qa_id),
-                "question": str(question_text),
-                "answer": str(answer_text),
-                "embedding": (
-                    np.array(embedding) if embedding is not None else np.array([])
-                ),
-                "url": str(url),
-            }
-            for qa_id, question_text, answer_text, embedding, url in question_answers
-        ]
+        stmt = stmt.where(QuestionAnswer.score != None)
+
+    with Session(engine) as session:
+        question_answers = session.execute(stmt).all()
+
+    return [
+        {
+            "id": int(qa_id),
+            "question": str(question_text),
+            "answer": str(answer_text),
+            "url": str(url),
+        }
+        for qa_id, question_text, answer_text, url in question_answers
+    ]
+
+
+def get_similar_question(
+    engine: Engine, embedding, max_distance: float = 0.6
+) -> tuple[str, str] | None:
+    """Ищет ближайший по косинусному расстоянию вопрос с оценкой "отлично"
+
+    Поиск выполняется на стороне Postgres через pgvector, поэтому в Python
+    попадает только одна строка вместо всех вопросов с оценками.
+
+    Args:
+        engine (Engine): текущее подключение к БД
+        embedding: векторное представление заданного вопроса
+        max_distance (float): максимально допустимое косинусное расстояние
 
-        return result
+    Returns:
+        tuple[str, str] | None: ответ и ссылка на Confluence, либо None,
+        если подходящего вопроса нет
+    """
+    distance = QuestionAnswer.embedding.cosine_distance(embedding)
+    with Session(engine) as session:
+        row = session.execute(
+            select(
+                QuestionAnswer.answer,
+                QuestionAnswer.confluence_url,
+                distance.label("distance"),
+            )
+            .where(QuestionAnswer.score == 5, QuestionAnswer.embedding != None)
+            .order_by(distance)
+            .limit(1)
+        ).first()
+
+    if row is None or row.distance > max_distance:
+        return None
+    return str(row.answer), str(row.confluence_url)
 
 
 def get_document_by_url(engine: Engine, url: str) -> str | None:
@@ -249,12 +436,13 @@ def get_document_by_url(engine: Engine, url: str) -> str | None:
     if not url:
         return None
 
+    stmt = lambda_stmt(
+        lambda: select(func.string_agg(Chunk.text, "\n\n").label("full_text")).where(
+            Chunk.confluence_url == url, Chunk.text != None
+        )
+    )
     with Session(engine) as session:
-        document = session.execute(
-            select(func.string_agg(Chunk.text, "\n\n").label("full_text")).where(
-                Chunk.confluence_url == url, Chunk.text != None
-            )
-        ).scalar_one_or_none()
+        document = session.execute(stmt).scalar_one_or_none()
 
     return document
 
@@ -262,7 +450,7 @@ def get_document_by_url(engine: Engine, url: str) -> str | None:
 def delete_score(engine: Engine, qa_id: int) -> None:
     """Удаляет оценку у вопроса и эмбеддинг, если оценка 5"""
     with Session(engine) as session:
-        qa = session.query(QuestionAnswer).filter(QuestionAnswer.id == qa_id).first()
+        qa = session.get(QuestionAnswer, qa_id)
 
         if qa:
             if qa.score == 5:
@@ -1,27 +1,29 @@
 from contextlib import redirect_stderr
 import io
 import logging
-import numpy as np
 from aiohttp import web
 import requests
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from sentence_transformers import SentenceTransformer
-from sqlalchemy import create_engine, select
+from sqlalchemy import select
 from sqlalchemy.orm import Session
 from config import Config
 from database import (
     Chunk,
+    get_engine,
     set_embedding,
+    set_embeddings,
     get_answer_by_id,
     get_all_questions_with_score,
     get_document_by_url,
+    get_similar_question,
     delete_score,
 )
 from confluence_retrieving import get_chunk, reindex_confluence
 from time import sleep
 
 routes = web.RouteTableDef()
-engine = create_engine(Config.SQLALCHEMY_DATABASE_URI)
+engine = get_engine()
 text_splitter = RecursiveCharacterTextSplitter(
     chunk_size=4096,
     chunk_overlap=200,
@@ -162,55 +164,19 @@ async def find_similar_question(
         tuple[str, str] | None: кортеж, содержащий наиболее близкий ответ и ссылку на документ в Confluence, иначе None.
     """
 
-    questions = get_all_questions_with_score(engine=engine)
     question_embedding = encoder_model.encode(question)
 
     logging.info(f"Question: '{question}' => Embedding: {question_embedding}")
 
-    best_match = None
-    best_cosine_distance = float("inf")
-    best_qa_id = None
-    best_qa_url = None
-
-    for q in questions:
-        qa_id, answer_text, embedding, url = (
-            q["id"],
-            q["answer"],
-            q["embedding"],
-            q["url"],
-        )
-
-        if embedding is None or len(embedding) == 0:
-            logging.warning(f"Skipping empty embedding for QA ID {qa_id}")
-            continue
-
-        if question_embedding.shape[0] != embedding.shape[0]:
-            logging.error(
-                f"Shape mismatch for QA ID {qa_id}: question {question_embedding.shape}, embedding {embedding.shape}"
-            )
-            continue
-
-        cosine_distance = 1 - np.dot(question_embedding, embedding) / (
-            np.linalg.norm(question_embedding) * np.linalg.norm(embedding)
-        )
-
-        logging.info(f"Cosine distance for QA ID {qa_id}: {cosine_distance}")
-
-        if cosine_distance < best_cosine_distance:
-            best_cosine_distance = cosine_distance
-            best_match = answer_text
-            best_qa_id = int(qa_id)
-            best_qa_url = url
-
-    if best_cosine_distance <= 0.6 and best_match and best_qa_id and best_qa_url:
-        logging.info(
-            f"Best match found for QA ID {best_qa_id} with cosine distance {best_cosine_distance}"
-        )
+    result = get_similar_question(
+        engine=engine, embedding=question_embedding, max_distance=0.6
+    )
+    if result:
+        best_match, best_qa_url = result
+        logging.info(f"Best match found with answer: {best_match[:50]}")
         return best_match, best_qa_url
 
-    logging.info(
-        f"No suitable match found for the question with cosine distance {best_cosine_distance}"
-    )
+    logging.info("No suitable match found for the question")
     return None
 
 
@@ -387,11 +353,11 @@ async def reembed(request: web.Request) -> web.Response:
     logging.warning("START CREATE EMBEDDING")
     try:
         questions = get_all_questions_with_score(engine)
-        for question in questions:
-            q_text = question["question"]
-            q_id = question["id"]
-            embed = encoder_model.encode(q_text)
-            set_embedding(engine, q_id, embed)
+        rows = [
+            {"id": question["id"], "embedding": encoder_model.encode(question["question"])}
+            for question in questions
+        ]
+        set_embeddings(engine, rows)
         logging.info("SUCCESSFULLY CREATED EMBEDDING")
         return web.Response(status=200)
     except Exception as e: